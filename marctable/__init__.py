@@ -34,37 +34,68 @@ def rule_params(f: Callable) -> Callable:
     f = click.option(
         "--batch", "-b", default=1000, help="Batch n records when converting"
     )(f)
+    f = click.option(
+        "--workers",
+        "-w",
+        default=1,
+        help="Parse MARC records using n processes, or 0 for one per CPU",
+    )(f)
     return f
 
 
 @cli.command()
 @io_params
 @rule_params
-def csv(infile: BinaryIO, outfile: TextIO, rules: list, batch: int) -> None:
+def csv(
+    infile: BinaryIO, outfile: TextIO, rules: list, batch: int, workers: int
+) -> None:
     """
     Convert MARC to CSV.
     """
-    to_csv(infile, outfile, rules=rules, batch=batch)
+    to_csv(infile, outfile, rules=rules, batch=batch, workers=workers)
 
 
 @cli.command()
 @io_params
 @rule_params
-def parquet(infile: BinaryIO, outfile: IOBase, rules: list, batch: int) -> None:
+@click.option(
+    "--dict-encode",
+    "-d",
+    "dict_encode",
+    multiple=True,
+    help="Dictionary encode a column with repetitive values, e.g. 040b",
+)
+def parquet(
+    infile: BinaryIO,
+    outfile: IOBase,
+    rules: list,
+    batch: int,
+    workers: int,
+    dict_encode: list,
+) -> None:
     """
     Convert MARC to Parquet.
     """
-    to_parquet(infile, outfile, rules=rules, batch=batch)
+    to_parquet(
+        infile,
+        outfile,
+        rules=rules,
+        batch=batch,
+        workers=workers,
+        dict_encode=dict_encode,
+    )
 
 
 @cli.command()
 @io_params
 @rule_params
-def jsonl(infile: BinaryIO, outfile: BinaryIO, rules: list, batch: int) -> None:
+def jsonl(
+    infile: BinaryIO, outfile: BinaryIO, rules: list, batch: int, workers: int
+) -> None:
     """
     Convert MARC to JSON Lines (JSONL)
     """
-    to_jsonl(infile, outfile, rules=rules, batch=batch)
+    to_jsonl(infile, outfile, rules=rules, batch=batch, workers=workers)
 
 
 @cli.command()
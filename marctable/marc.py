@@ -9,50 +9,68 @@ specification the Library of Congress website.
 For more about Avram see https://format.gbv.de/schema/avram/specification
 """
 
+import hashlib
 import json
 import pathlib
 import re
 import sys
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
 from functools import cache
-from typing import IO, Generator, List, Optional, Type
+from typing import IO, Deque, Dict, Generator, Optional, Type
 from urllib.parse import urljoin
 
 import requests
 from bs4 import BeautifulSoup, Tag
+from requests.adapters import HTTPAdapter, Retry
 
+try:
+    import orjson
+except ImportError:
+    orjson = None  # type: ignore[assignment]
 
+# patterns for the text of the Library of Congress MARC documentation pages
+GROUP_PATTERN = re.compile(r"^\d+")
+FIELD_PATTERN = re.compile(r"^(\d+) - (.+) \((.+)\)$")
+SUBFIELD_PATTERN = re.compile(r"^\$(.) - (.+) \((.+)\)$")
+SUBFIELD_TEXT_PATTERN = re.compile(r"^(.) - (.+) \((.+)\)$")
+
+# the Avram schema that ships with marctable
+AVRAM_FILE = str(pathlib.Path(__file__).parent / "marc.json")
+
+# the number of field pages to fetch at the same time when crawling
+CRAWL_WORKERS = 16
+
+# seconds to wait for the LoC website to respond
+CRAWL_TIMEOUT = 10
+
+
+@dataclass(slots=True)
 class Subfield:
-    def __init__(self, code: str, label: str, repeatable: bool = False) -> None:
-        self.code = code
-        self.label = label
-        self.repeatable = repeatable
+    code: str
+    label: str
+    repeatable: bool = False
 
     @classmethod
     def from_dict(cls: Type["Subfield"], d: dict) -> "Subfield":
-        return Subfield(d["code"], d["label"], d["repeatable"])
+        return cls(d["code"], d["label"], d["repeatable"])
 
     def to_dict(self) -> dict:
         return {"code": self.code, "label": self.label, "repeatable": self.repeatable}
 
 
+@dataclass(slots=True)
 class Field:
-    def __init__(
-        self,
-        tag: str,
-        label: str,
-        subfields: list[Subfield],
-        repeatable: bool = False,
-        url: Optional[str] = None,
-    ) -> None:
-        self.tag = tag
-        self.label = label
-        self.subfields = subfields
-        self.repeatable = repeatable
-        self.url = url
+    tag: str
+    label: str
+    subfields: dict[str, Subfield]
+    repeatable: bool = False
+    url: Optional[str] = None
 
     def __str__(self) -> str:
         if len(self.subfields) > 0:
-            subfields = ": " + (",".join([sf.code for sf in self.subfields]))
+            subfields = ": " + (",".join(self.subfields.keys()))
         else:
             subfields = ""
         return (
@@ -61,12 +79,15 @@ class Field:
 
     @classmethod
     def from_dict(cls: Type["Field"], d: dict) -> "Field":
-        return Field(
+        return cls(
             tag=d["tag"],
             label=d["label"],
             repeatable=d["repeatable"],
             url=d.get("url"),
-            subfields=[Subfield.from_dict(d) for d in d.get("subfields", {}).values()],
+            subfields={
+                code: Subfield.from_dict(sf)
+                for code, sf in d.get("subfields", {}).items()
+            },
         )
 
     def to_dict(self) -> dict:
@@ -78,50 +99,67 @@ class Field:
         }
 
         if self.subfields is not None:
-            d["subfields"] = {sf.code: sf.to_dict() for sf in self.subfields}
+            d["subfields"] = {code: sf.to_dict() for code, sf in self.subfields.items()}
 
         return d
 
     def get_subfield(self, code: str) -> Subfield:
-        for sf in self.subfields:
-            if sf.code == code:
-                return sf
-        raise SchemaSubfieldError(f"{code} is not a valid subfield in field {self.tag}")
+        sf = self.subfields.get(code)
+        if sf is None:
+            raise SchemaSubfieldError(
+                f"{code} is not a valid subfield in field {self.tag}"
+            )
+        return sf
 
 
 class MARC:
     def __init__(self) -> None:
-        self.fields: List[Field] = []
+        self.fields: Dict[str, Field] = {}
 
-    @cache
     def get_field(self, tag: str) -> Field:
-        for field in self.fields:
-            if field.tag == tag:
-                return field
-        raise SchemaFieldError(f"{tag} is not a defined field tag in Avram schema")
+        field = self.fields.get(tag)
+        if field is None:
+            raise SchemaFieldError(f"{tag} is not a defined field tag in Avram schema")
+        return field
 
-    @cache
     def get_subfield(self, tag: str, code: str) -> Subfield:
-        field = self.get_field(tag)
-        return field.get_subfield(code)
+        return self.get_field(tag).get_subfield(code)
 
     @property
     def avram_file(self) -> pathlib.Path:
-        return pathlib.Path(__file__).parent / "marc.json"
+        return pathlib.Path(AVRAM_FILE)
 
     @classmethod
-    @cache
     def from_avram(cls: Type["MARC"], avram_file: Optional[IO] = None) -> "MARC":
-        marc = MARC()
-
+        """
+        Load the schema from an Avram JSON file. When no file is given the
+        schema that ships with marctable is used. Schemas are parsed once and
+        shared, keyed on the contents of the file.
+        """
         if avram_file is None:
-            avram_file = marc.avram_file.open("r")
+            return cls._from_avram_path(AVRAM_FILE)
+
+        data = avram_file.read()
+        if isinstance(data, str):
+            data = data.encode("utf8")
 
-        for d in json.load(avram_file)["fields"].values():
-            marc.fields.append(Field.from_dict(d))
+        key = hashlib.blake2s(data, digest_size=8).digest()
+        marc = _schemas.get(key)
+        if marc is None:
+            marc = cls()
+            for d in _json_loads(data)["fields"].values():
+                field = Field.from_dict(d)
+                marc.fields[field.tag] = field
+            _schemas[key] = marc
 
         return marc
 
+    @classmethod
+    @cache
+    def _from_avram_path(cls: Type["MARC"], path: str) -> "MARC":
+        with open(path, "rb") as avram_file:
+            return cls.from_avram(avram_file)
+
     def to_avram(self, avram_file: Optional[IO] = None) -> None:
         if avram_file is None:
             avram_file = self.avram_file.open("w")
@@ -131,11 +169,21 @@ class MARC:
             "url": "https://www.loc.gov/marc/bibliographic/",
             "family": "marc",
             "language": "en",
-            "fields": {f.tag: f.to_dict() for f in self.fields},
+            "fields": {tag: f.to_dict() for tag, f in self.fields.items()},
         }
         json.dump(d, avram_file, indent=2)
 
 
+# parsed Avram schemas, keyed on a hash of their JSON
+_schemas: Dict[bytes, MARC] = {}
+
+
+def _json_loads(data: bytes) -> dict:
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
 class SchemaFieldError(Exception):
     pass
 
@@ -144,18 +192,44 @@ class SchemaSubfieldError(Exception):
     pass
 
 
-def fields() -> Generator[Field, None, None]:
+def fields(workers: int = CRAWL_WORKERS) -> Generator[Field, None, None]:
+    """
+    Generate the fields documented on the Library of Congress website, in the
+    order they are listed. Field pages are fetched by a pool of threads, since
+    most of the time is spent waiting on the network. A few more pages than
+    there are threads are requested ahead, and another one as each is finished
+    with, so a slow page doesn't leave the other threads idle.
+    """
+    pending: Deque[Future] = deque()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        try:
+            for url in field_urls():
+                pending.append(executor.submit(make_field, url))
+                if len(pending) < workers * 2:
+                    continue
+                if field := pending.popleft().result():
+                    yield field
+
+            while pending:
+                if field := pending.popleft().result():
+                    yield field
+
+        # don't fetch pages that haven't started when the caller stops early
+        finally:
+            for future in pending:
+                future.cancel()
+
+
+def field_urls() -> Generator[str, None, None]:
     toc_url = "https://www.loc.gov/marc/bibliographic/"
     toc_doc = _soup(toc_url)
     for group_link in toc_doc.select(".contentslist a"):
-        if re.match(r"^\d+", group_link.text):
+        if GROUP_PATTERN.match(group_link.text):
             group_url = urljoin(toc_url, group_link.attrs["href"])
             group_doc = _soup(group_url)
             for field_link in group_doc.select("a"):
                 if field_link.text == "Full":
-                    field_url = urljoin(group_url, field_link.attrs["href"])
-                    if field := make_field(field_url):
-                        yield field
+                    yield urljoin(group_url, field_link.attrs["href"])
 
 
 def make_field(url: str) -> Optional[Field]:
@@ -165,27 +239,27 @@ def make_field(url: str) -> Optional[Field]:
         raise Exception("Expecting h1 element in {url}")
 
     h1_text: str = h1.text.strip()
-    if m1 := re.match(r"^(\d+) - (.+) \((.+)\)$", h1_text):
+    if m1 := FIELD_PATTERN.match(h1_text):
         tag, label, repeatable = m1.groups()
 
         # most pages put the subfield info in a list
-        subfields = []
+        subfields = {}
         for el in soup.select("table.subfields li"):
-            if m2 := re.match(r"^\$(.) - (.+) \((.+)\)$", el.text):
-                subfields.append(Subfield(m2.group(1), m2.group(2), m2.group(3) == "R"))
+            if m2 := SUBFIELD_PATTERN.match(el.text):
+                subfields[m2.group(1)] = Subfield(
+                    m2.group(1), m2.group(2), m2.group(3) == "R"
+                )
 
         # some pages use a different layout, of course
         if len(subfields) == 0:
             for el in soup.select('td[colspan="1"]'):
                 for text in el.text.split("$"):
                     text = text.strip()
-                    if m2 := re.match(r"^(.) - (.+) \((.+)\)$", text):
-                        subfields.append(
-                            Subfield(
-                                code=m2.group(1),
-                                label=m2.group(2),
-                                repeatable=m2.group(3) == "R",
-                            )
+                    if m2 := SUBFIELD_TEXT_PATTERN.match(text):
+                        subfields[m2.group(1)] = Subfield(
+                            code=m2.group(1),
+                            label=m2.group(2),
+                            repeatable=m2.group(3) == "R",
                         )
 
         return Field(
@@ -203,7 +277,7 @@ def make_field(url: str) -> Optional[Field]:
 def crawl(n: int = 0, quiet: bool = False, outfile: IO = sys.stdout) -> None:
     marc = MARC()
     for f in fields():
-        marc.fields.append(f)
+        marc.fields[f.tag] = f
         if not quiet:
             print(f)
         if n != 0 and len(marc.fields) >= n:
@@ -212,4 +286,24 @@ def crawl(n: int = 0, quiet: bool = False, outfile: IO = sys.stdout) -> None:
 
 
 def _soup(url: str) -> BeautifulSoup:
-    return BeautifulSoup(requests.get(url).text, "html.parser")
+    resp = _session().get(url, timeout=CRAWL_TIMEOUT)
+    resp.raise_for_status()
+    # let BeautifulSoup work out the encoding from the bytes, which is quicker
+    # than having requests guess it for the text
+    return BeautifulSoup(resp.content, "html.parser")
+
+
+@cache
+def _session() -> requests.Session:
+    """
+    Return a session that is shared by the crawl threads, so that connections
+    to the LoC website are kept alive and reused rather than set up for every
+    page. Failed requests are retried.
+    """
+    session = requests.Session()
+    retry = Retry(total=3, backoff_factor=0.3, status_forcelist=[502, 503, 504])
+    adapter = HTTPAdapter(
+        pool_connections=1, pool_maxsize=CRAWL_WORKERS, max_retries=retry
+    )
+    session.mount("https://", adapter)
+    return session
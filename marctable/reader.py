@@ -0,0 +1,345 @@
+"""
+This module contains a lightweight reader for MARC21 records in transmission
+format. Rather than building pymarc Record, Field and Subfield objects for
+every field in every record it walks the leader and directory of each record
+itself, and only decodes the fields that have been asked for. A record is
+returned as a list of (tag, data) tuples, where data is a string for control
+fields and a list of (code, value) tuples for data fields.
+
+The decoding rules mirror pymarc's MARCReader, including the use of MARC-8 for
+records that don't declare themselves as UTF-8 in the leader. MARCXML is read
+into the same structure, one record at a time, using ElementTree.iterparse.
+"""
+
+import mmap
+import re
+import struct
+from io import BytesIO
+from typing import (
+    BinaryIO,
+    Collection,
+    Dict,
+    FrozenSet,
+    Generator,
+    List,
+    Optional,
+    Tuple,
+    Union,
+)
+from xml.etree import ElementTree
+
+import pymarc
+from pymarc import marc8_to_unicode
+
+Subfields = List[Tuple[str, str]]
+Fields = List[Tuple[str, Union[str, Subfields]]]
+
+# tags to parse, and the subfield codes to decode for each of them (or None for all)
+Wanted = Dict[bytes, Optional[FrozenSet[int]]]
+
+LEADER_LEN = 24
+DIRECTORY_ENTRY_LEN = 12
+END_OF_FIELD = 0x1E
+END_OF_RECORD = 0x1D
+SUBFIELD_INDICATOR = b"\x1f"
+
+# MARC-8 text that is printable ASCII, which it translates to unchanged
+MARC8_ASCII_PATTERN = re.compile(rb"[\x20-\x7e]*")
+
+# a directory entry: tag, field length and field offset
+DIRECTORY_ENTRY = struct.Struct("3s4s5s")
+
+# control fields are assumed to be numeric tags below 010, just like pymarc does
+CONTROL_TAGS = frozenset(b"%03d" % i for i in range(10))
+
+READ_SIZE = 1024 * 1024
+
+
+def read_records(
+    marc_input: BinaryIO,
+    tags: Optional[Collection[str]] = None,
+    subfields: Optional[Dict[str, Optional[Collection[str]]]] = None,
+) -> Generator[Fields, None, None]:
+    """
+    Read MARC21 records from a file and generate the fields for each one,
+    limited to the given tags if they are supplied. The subfields of a tag can
+    also be limited to the codes given for it in subfields. Records that can't
+    be parsed are skipped.
+    """
+    wanted = wanted_fields(tags, subfields)
+    for raw in split_records(marc_input):
+        fields = parse_record(raw, wanted)
+        if fields is not None:
+            yield fields
+
+
+def wanted_fields(
+    tags: Optional[Collection[str]] = None,
+    subfields: Optional[Dict[str, Optional[Collection[str]]]] = None,
+) -> Optional[Wanted]:
+    """
+    Turn tags and subfield codes into the byte level lookup that parse_record
+    uses, which is None when every field is wanted.
+
+    >>> wanted_fields(["245", "650"], {"650": ["a"]})
+    {b'245': None, b'650': frozenset({97})}
+    """
+    if tags is None:
+        return None
+    subfields = subfields or {}
+    wanted: Wanted = {}
+    for tag in tags:
+        codes = subfields.get(tag)
+        wanted[tag.encode("ascii")] = (
+            None if codes is None else frozenset(ord(code) for code in codes)
+        )
+    return wanted
+
+
+def split_records(marc_input: BinaryIO) -> Generator[bytes, None, None]:
+    """
+    Split a file of MARC21 records into the raw bytes for each record, using
+    the record length at the start of each leader. Regular files are memory
+    mapped, in memory BytesIO input is split in place, and anything else (like
+    stdin) is read in large chunks.
+    """
+    if isinstance(marc_input, BytesIO):
+        # getvalue doesn't copy a BytesIO that hasn't been written to
+        yield from _split_mapped(marc_input.getvalue(), marc_input.tell())
+        return
+
+    mapped = _mmap(marc_input)
+    if mapped is not None:
+        with mapped:
+            yield from _split_mapped(mapped, marc_input.tell())
+        return
+
+    buf = b""
+    pos = 0
+    while True:
+        if len(buf) - pos < 5:
+            buf = buf[pos:] + marc_input.read(READ_SIZE)
+            pos = 0
+            if len(buf) < 5:
+                return
+
+        try:
+            length = int(buf[pos : pos + 5])
+        except ValueError:
+            length = 0
+
+        # skip to the end of the current record if the length is unusable
+        if length < LEADER_LEN:
+            end = buf.find(b"\x1d", pos)
+            while end == -1:
+                more = marc_input.read(READ_SIZE)
+                if not more:
+                    return
+                buf = buf[pos:] + more
+                pos = 0
+                end = buf.find(b"\x1d")
+            pos = end + 1
+            continue
+
+        while len(buf) - pos < length:
+            more = marc_input.read(max(READ_SIZE, length))
+            if not more:
+                # truncated record at the end of the file
+                return
+            buf = buf[pos:] + more
+            pos = 0
+
+        raw = buf[pos : pos + length]
+        pos += length
+        if raw[-1] == END_OF_RECORD:
+            yield raw
+
+
+def _mmap(marc_input: BinaryIO) -> Optional[mmap.mmap]:
+    """
+    Memory map the input if it is a regular file that isn't empty.
+    """
+    try:
+        if not marc_input.seekable():
+            return None
+        return mmap.mmap(marc_input.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        # io.UnsupportedOperation is an OSError, and empty files can't be mapped
+        return None
+
+
+def _split_mapped(
+    data: Union[mmap.mmap, bytes], pos: int
+) -> Generator[bytes, None, None]:
+    size = len(data)
+    while size - pos >= 5:
+        try:
+            length = int(data[pos : pos + 5])
+        except ValueError:
+            length = 0
+
+        # skip to the end of the current record if the length is unusable
+        if length < LEADER_LEN:
+            end = data.find(b"\x1d", pos)
+            if end == -1:
+                return
+            pos = end + 1
+            continue
+
+        if size - pos < length:
+            # truncated record at the end of the file
+            return
+
+        raw = data[pos : pos + length]
+        pos += length
+        if raw[-1] == END_OF_RECORD:
+            yield raw
+
+
+def parse_record(raw: bytes, wanted: Optional[Wanted] = None) -> Optional[Fields]:
+    """
+    Parse the raw bytes of a MARC21 record into a list of fields. If wanted is
+    given only the fields whose tag (as bytes) it contains are decoded, along
+    with just the subfield codes it lists for them. None is returned when the
+    record is malformed.
+    """
+    try:
+        utf8 = raw[9] == 0x61  # "a" in leader position 9 means UTF-8
+        base_address = int(raw[12:17])
+        if base_address <= 0 or base_address >= len(raw):
+            return None
+
+        directory = raw[LEADER_LEN : base_address - 1]
+        if len(directory) % DIRECTORY_ENTRY_LEN != 0 or len(directory) == 0:
+            return None
+
+        fields: Fields = []
+        # control fields in MARC-8 records are decoded like pymarc does
+        encoding = "utf-8" if utf8 else "iso8859-1"
+        # unpacking the directory entries is quicker than slicing them
+        for tag_bytes, length_bytes, offset in DIRECTORY_ENTRY.iter_unpack(directory):
+            if wanted is not None and tag_bytes not in wanted:
+                continue
+
+            tag = tag_bytes.decode("ascii")
+            length = int(length_bytes)
+            start = base_address + int(offset)
+            data = raw[start : start + length - 1]
+
+            if tag_bytes in CONTROL_TAGS:
+                fields.append((tag, data.decode(encoding)))
+            else:
+                codes = None if wanted is None else wanted[tag_bytes]
+                fields.append((tag, _parse_subfields(data, utf8, codes)))
+
+        return fields
+
+    except ValueError:
+        # also catches UnicodeDecodeError
+        return None
+
+
+def _parse_subfields(
+    data: bytes, utf8: bool, codes: Optional[FrozenSet[int]] = None
+) -> Subfields:
+    # a single bytes.split scans the field in C, which is much quicker for
+    # fields this short than finding the delimiters with a NumPy array
+    subs = data.split(SUBFIELD_INDICATOR)
+
+    # pymarc rejects the record if the indicators aren't ASCII
+    subs[0].decode("ascii")
+
+    subfields: Subfields = []
+    for sf in subs[1:]:
+        # skip empty subfields and ones that weren't asked for
+        if not sf or (codes is not None and sf[0] not in codes):
+            continue
+        if sf[0] < 0x80:
+            code = chr(sf[0])
+            skip = 1
+        else:
+            code, skip = pymarc.record.normalize_subfield_code(sf)
+        if utf8:
+            value = sf[skip:].decode("utf-8")
+        else:
+            value = _marc8_to_unicode(sf[skip:])
+        subfields.append((code, value))
+
+    return subfields
+
+
+def _marc8_to_unicode(data: bytes) -> str:
+    """
+    Decode MARC-8 text, skipping pymarc's character by character translation
+    for the common case of text that is printable ASCII.
+    """
+    if MARC8_ASCII_PATTERN.fullmatch(data):
+        return data.decode("ascii")
+    return marc8_to_unicode(data)
+
+
+def read_xml_records(
+    xml_input: BinaryIO,
+    tags: Optional[Collection[str]] = None,
+    subfields: Optional[Dict[str, Optional[Collection[str]]]] = None,
+) -> Generator[Fields, None, None]:
+    """
+    Read MARCXML records incrementally and generate the same fields that
+    read_records does, so that only one record needs to be in memory at a
+    time. Like pymarc, namespaces are ignored.
+    """
+    tags = None if tags is None else frozenset(tags)
+    subfields = subfields or {}
+
+    root = None
+    for event, elem in ElementTree.iterparse(xml_input, events=("start", "end")):
+        if event == "start":
+            if root is None:
+                root = elem
+            continue
+
+        if _local_name(elem.tag) != "record":
+            continue
+
+        fields: Fields = []
+        for child in elem:
+            element = _local_name(child.tag)
+            if element != "controlfield" and element != "datafield":
+                continue
+
+            tag = child.get("tag", "")
+            if tags is not None and tag not in tags:
+                continue
+
+            if tag.encode("utf8") in CONTROL_TAGS:
+                data = child.text if element == "controlfield" else None
+                fields.append((tag, data or ""))
+            elif element == "controlfield":
+                fields.append((tag, []))
+            else:
+                codes = subfields.get(tag)
+                fields.append((tag, _xml_subfields(child, codes)))
+
+        yield fields
+
+        # let go of the records that have been read
+        elem.clear()
+        if root is not None:
+            root.clear()
+
+
+def _xml_subfields(
+    datafield: ElementTree.Element, codes: Optional[Collection[str]]
+) -> Subfields:
+    subfields = []
+    for sf in datafield:
+        code = sf.get("code")
+        if _local_name(sf.tag) != "subfield" or not code:
+            continue
+        if codes is None or code in codes:
+            subfields.append((code, sf.text or ""))
+    return subfields
+
+
+def _local_name(tag: str) -> str:
+    return tag.rpartition("}")[2]
@@ -1,37 +1,125 @@
 import json
-from io import IOBase
-from typing import BinaryIO, Dict, Generator, List, TextIO, Tuple, Union
-
+import os
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from functools import cache
+from io import IOBase, TextIOBase
+from typing import (
+    IO,
+    Any,
+    BinaryIO,
+    Callable,
+    Deque,
+    Dict,
+    Generator,
+    Iterable,
+    List,
+    Optional,
+    Tuple,
+    Union,
+)
+
+import numpy
 import pyarrow
-import pymarc
-from pandas import DataFrame
+import pyarrow.csv
+from pandas import ArrowDtype, DataFrame
 from pyarrow.parquet import ParquetWriter
 
-from .marc import MARC
+try:
+    import orjson
+except ImportError:
+    orjson = None  # type: ignore[assignment]
 
-ListOrString = Union[str, List[str]]
+from .marc import MARC
+from .reader import (
+    CONTROL_TAGS,
+    Fields,
+    Subfields,
+    Wanted,
+    parse_record,
+    read_records,
+    read_xml_records,
+    split_records,
+    wanted_fields,
+)
+
+# the number of records each worker parses at a time when not batching output
+PARALLEL_BATCH = 1000
+
+# the number of records in each Parquet row group
+ROW_GROUP_SIZE = 100_000
+
+# the most rows that columns are allocated with before any records are read
+ALLOCATE_ROWS = 1000
+
+# fields like control numbers and timestamps that hold a different value for
+# nearly every record, which Parquet dictionary encoding only makes bigger
+UNIQUE_TAGS = {"001", "005", "008", "010", "020"}
+
+
+def to_dataframe(
+    marc_input: BinaryIO, rules: list = [], workers: int = 1, arrow: bool = False
+) -> DataFrame:
+    """
+    Return a single DataFrame for the entire dataset.
+    """
+    if arrow:
+        table = to_table(marc_input, rules, workers=workers)
+        return table.to_pandas(types_mapper=ArrowDtype)  # type: ignore[return-value]
+    return next(dataframe_iter(marc_input, rules, batch=0, workers=workers))
 
 
-def to_dataframe(marc_input: BinaryIO, rules: list = []) -> DataFrame:
+def to_table(
+    marc_input: BinaryIO,
+    rules: list = [],
+    batch: int = 1000,
+    workers: int = 1,
+    dict_encode: list = [],
+) -> pyarrow.Table:
     """
-    Return a single DataFrame for the entire dataset.
+    Return a single Arrow Table for the entire dataset.
     """
-    return next(dataframe_iter(marc_input, rules, batch=0))
+    mapping = _mapping(rules)
+    schema = _make_parquet_schema(mapping, dict_encode)
+    batches = _record_batches(marc_input, mapping, schema, batch, workers)
+    return pyarrow.Table.from_batches(batches, schema)  # type: ignore[arg-type]
 
 
 def to_csv(
     marc_input: BinaryIO,
-    csv_output: TextIO,
+    csv_output: IO,
     rules: list = [],
     batch: int = 1000,
+    workers: int = 1,
 ) -> None:
     """
     Convert MARC to CSV.
     """
-    first_batch = True
-    for df in dataframe_iter(marc_input, rules=rules, batch=batch):
-        df.to_csv(csv_output, header=first_batch, index=False)
-        first_batch = False
+    # repeatable columns are written using the string form of their lists
+    mapping = _mapping(rules)
+    parquet_schema = _make_parquet_schema(mapping)
+    list_columns = [f.name for f in parquet_schema if f.type != pyarrow.string()]
+    cols: List[Tuple[str, pyarrow.DataType]] = [
+        (name, pyarrow.string()) for name in parquet_schema.names
+    ]
+    schema = pyarrow.schema(cols)  # type: ignore[arg-type]
+
+    record_batches = (
+        _record_batch(_stringify_lists(columns, list_columns), schema)
+        for columns in _columns_iter(marc_input, mapping, batch, workers)
+    )
+
+    # binary outputs are streamed to by a single Arrow CSV writer, but text
+    # outputs need each batch written out as a string
+    if isinstance(csv_output, TextIOBase):
+        # the header is written even if there are no records, like CSVWriter does
+        csv_output.write(_csv_text(schema.empty_table(), include_header=True))
+        for record_batch in record_batches:
+            csv_output.write(_csv_text(record_batch, include_header=False))
+    else:
+        with pyarrow.csv.CSVWriter(csv_output, schema) as writer:
+            for record_batch in record_batches:
+                writer.write_batch(record_batch)
 
 
 def to_jsonl(
@@ -39,13 +127,13 @@ def to_jsonl(
     jsonl_output: BinaryIO,
     rules: list = [],
     batch: int = 1000,
+    workers: int = 1,
 ) -> None:
     """
     Convert MARC to JSON Lines (JSONL).
     """
-    for records in records_iter(marc_input, rules=rules, batch=batch):
-        for record in records:
-            jsonl_output.write(json.dumps(record).encode("utf8") + b"\n")
+    for records in records_iter(marc_input, rules, batch, workers):
+        jsonl_output.write(_jsonl(records))
 
 
 def to_parquet(
@@ -53,135 +141,560 @@ def to_parquet(
     parquet_output: IOBase,
     rules: list = [],
     batch: int = 1000,
+    workers: int = 1,
+    dict_encode: list = [],
+    row_group_size: int = ROW_GROUP_SIZE,
 ) -> None:
     """
     Convert MARC to Parquet.
     """
-    schema = _make_parquet_schema(rules)
-    writer = ParquetWriter(parquet_output, schema, compression="SNAPPY")
-    for records_batch in records_iter(marc_input, rules=rules, batch=batch):
-        table = pyarrow.Table.from_pylist(records_batch, schema)
-        writer.write_table(table)
-
-    writer.close()
+    mapping = _mapping(rules)
+    schema = _make_parquet_schema(mapping, dict_encode)
+    with ParquetWriter(
+        parquet_output,
+        schema,
+        compression="ZSTD",
+        use_dictionary=_dictionary_columns(schema),
+    ) as writer:
+        pending: List[pyarrow.RecordBatch] = []
+        pending_rows = 0
+        for record_batch in _record_batches(
+            marc_input, mapping, schema, batch, workers
+        ):
+            pending.append(record_batch)
+            pending_rows += record_batch.num_rows
+            if pending_rows >= row_group_size:
+                _write_row_group(writer, pending, row_group_size)
+                pending = []
+                pending_rows = 0
+
+        if pending:
+            _write_row_group(writer, pending, row_group_size)
 
 
 def dataframe_iter(
-    marc_input: BinaryIO, rules: list = [], batch: int = 1000
+    marc_input: BinaryIO, rules: list = [], batch: int = 1000, workers: int = 1
 ) -> Generator[DataFrame, None, None]:
-    columns = _columns(_mapping(rules))
-    for records_batch in records_iter(marc_input, rules, batch):
-        yield DataFrame.from_records(records_batch, columns=columns)
+    """
+    Read MARC input and generate a DataFrame for each batch of records.
+    """
+    for columns in columns_iter(marc_input, rules, batch, workers):
+        # object arrays save pandas from inferring the type of every column
+        arrays = {
+            name: numpy.fromiter(col, dtype=object, count=len(col))
+            for name, col in columns.items()
+        }
+        yield DataFrame(arrays, copy=False)
+
+
+def record_batch_iter(
+    marc_input: BinaryIO,
+    rules: list = [],
+    batch: int = 1000,
+    workers: int = 1,
+    dict_encode: list = [],
+) -> Generator[pyarrow.RecordBatch, None, None]:
+    """
+    Read MARC input and generate an Arrow RecordBatch for each batch of records.
+    """
+    mapping = _mapping(rules)
+    schema = _make_parquet_schema(mapping, dict_encode)
+    yield from _record_batches(marc_input, mapping, schema, batch, workers)
 
 
 def records_iter(
-    marc_input: BinaryIO, rules: list = [], batch: int = 1000
+    marc_input: BinaryIO, rules: list = [], batch: int = 1000, workers: int = 1
 ) -> Generator[List[Dict], None, None]:
     """
     Read MARC input and generate a list of dictionaries, where each list element
     represents a MARC record.
     """
-    mapping = _mapping(rules)
-    marc = MARC.from_avram()
+    for columns in columns_iter(marc_input, rules, batch, workers):
+        # fill in the records a column at a time, since most cells are empty
+        size = len(next(iter(columns.values()), []))
+        records: List[Dict] = [{} for _ in range(size)]
+        for name, col in columns.items():
+            if _is_empty(col):
+                continue
+            for record, value in zip(records, col):
+                if value is not None:
+                    record[name] = value
+        yield records
+
+
+def columns_iter(
+    marc_input: BinaryIO, rules: list = [], batch: int = 1000, workers: int = 1
+) -> Generator[Dict[str, List], None, None]:
+    """
+    Read MARC input and generate a dictionary of columns for each batch of records.
+    """
+    yield from _columns_iter(marc_input, _mapping(rules), batch, workers)
 
-    # TODO: MARCXML parsing brings all the records into memory
-    if marc_input.name.endswith(".xml"):
-        reader = pymarc.marcxml.parse_xml_to_array(marc_input)
+
+def _columns_iter(
+    marc_input: BinaryIO, mapping: dict, batch: int, workers: int
+) -> Generator[Dict[str, List], None, None]:
+    """
+    Generate batches of columns like columns_iter does, for a mapping that
+    the caller has already made from the rules.
+    """
+    if workers == 0:
+        workers = os.cpu_count() or 1
+
+    # in memory inputs like BytesIO have no name, and files opened from a file
+    # descriptor are named by it, so both are read as MARC21
+    name = getattr(marc_input, "name", None)
+    if isinstance(name, str) and name.endswith(".xml"):
+        # only the mapped fields and subfields are kept
+        records = read_xml_records(marc_input, mapping.keys(), mapping)
+        yield from _columns_batches(records, mapping, batch)
+    elif workers > 1:
+        yield from _parallel_columns_iter(marc_input, mapping, batch, workers)
     else:
-        reader = pymarc.MARCReader(marc_input)
+        # only the mapped fields and subfields are decoded
+        records = read_records(marc_input, mapping.keys(), mapping)
+        yield from _columns_batches(records, mapping, batch)
 
-    rows = []
-    for record in reader:
-        # if pymarc can't make sense of a record it returns None
-        if record is None:
-            # TODO: log this?
-            continue
 
-        r: Dict[str, ListOrString] = {}
-        for field in record.fields:
-            if field.tag not in mapping:
-                continue
+# the column name and repeatability for a value taken from a field or subfield
+Target = Tuple[str, bool]
+
+# a function that adds a value to a column for a row
+Adder = Callable[[List, int, Optional[str]], None]
+
+# the same, but with the list that holds the column's values for a batch and
+# the function that adds to it, and for whole fields the function that turns
+# the field's data into a string
+BoundTarget = Tuple[List, Adder]
+BoundFieldTarget = Tuple[List, Adder, Callable[[Any], str]]
 
-            subfields = mapping[field.tag]
+
+def _record_batches(
+    marc_input: BinaryIO,
+    mapping: dict,
+    schema: pyarrow.Schema,
+    batch: int,
+    workers: int,
+) -> Generator[pyarrow.RecordBatch, None, None]:
+    for columns in _columns_iter(marc_input, mapping, batch, workers):
+        yield _record_batch(columns, schema)
+
+
+def _columns_batches(
+    records: Iterable[Fields], mapping: dict, batch: int, allocate: int = -1
+) -> Generator[Dict[str, List], None, None]:
+    """
+    Turn records into batches of columns using the mapping. Columns start out
+    with room for up to ALLOCATE_ROWS rows, or for allocate rows when the
+    number of records is already known.
+    """
+    plan = _plan(mapping)
+    rows = min(batch, ALLOCATE_ROWS) if allocate < 0 else allocate
+    columns = _new_columns(_columns(mapping), rows)
+    targets = _bind_plan(plan, columns)
+
+    # a local name is quicker to look up in the loop below than an attribute
+    get_target = targets.get
+
+    row = 0
+    for fields in records:
+        for tag, data in fields:
+            target = get_target(tag)
+            if target is None:
+                continue
 
             # if subfields aren't specified stringify them
-            if subfields is None:
-                key = f"F{field.tag}"
-                if marc.get_field(field.tag).repeatable:
-                    lst = r.get(key, [])
-                    assert isinstance(
-                        lst, list
-                    ), "Repeatable field contains a string instead of a list"
-                    lst.append(_stringify_field(field))
-                    r[key] = lst
-                else:
-                    s = _stringify_field(field)
-                    r[key] = s
+            if isinstance(target, tuple):
+                col, add, stringify = target
+                add(col, row, stringify(data))
 
             # otherwise only add the subfields that were requested in the mapping
+            elif not isinstance(data, str):
+                for code, sf_value in data:
+                    if sf_target := target.get(code):
+                        col, add = sf_target
+                        add(col, row, sf_value)
+
+        # yield a batch of columns when it is ready
+        row += 1
+        if batch > 0 and row == batch:
+            yield _resize_columns(columns, row)
+            columns = _new_columns(columns, rows)
+            targets = _bind_plan(plan, columns)
+            get_target = targets.get
+            row = 0
+
+    # return any remaining rows
+    if row > 0:
+        yield _resize_columns(columns, row)
+
+
+def _parallel_columns_iter(
+    marc_input: BinaryIO, mapping: dict, batch: int, workers: int
+) -> Generator[Dict[str, List], None, None]:
+    """
+    Split MARC21 input into raw records in this process, and have a pool of
+    worker processes parse them into columns. Batches are yielded in the order
+    that they were read, and only a few of them are in flight at any one time
+    so that memory use stays bounded.
+    """
+    parsed = _parallel_parse(marc_input, mapping, batch or PARALLEL_BATCH, workers)
+    if batch > 0:
+        yield from _rebatch(parsed, batch)
+        return
+
+    merged: Optional[Dict[str, List]] = None
+    for columns in parsed:
+        merged = _merge_columns(merged, columns)
+    if merged is not None:
+        yield merged
+
+
+def _parallel_parse(
+    marc_input: BinaryIO, mapping: dict, size: int, workers: int
+) -> Generator[Dict[str, List], None, None]:
+    """
+    Generate the columns that the workers parse from each chunk of raw records,
+    skipping chunks that had no valid records.
+    """
+    chunks = _chunked(split_records(marc_input), size)
+    pending: Deque[Future] = deque()
+
+    with ProcessPoolExecutor(
+        max_workers=workers, initializer=_init_worker, initargs=(mapping,)
+    ) as executor:
+        for chunk in chunks:
+            pending.append(executor.submit(_parse_chunk, chunk))
+            if len(pending) < workers * 2:
+                continue
+            columns = pending.popleft().result()
+            if columns is not None:
+                yield columns
+
+        while pending:
+            columns = pending.popleft().result()
+            if columns is not None:
+                yield columns
+
+
+def _rebatch(
+    batches: Iterable[Dict[str, List]], size: int
+) -> Generator[Dict[str, List], None, None]:
+    """
+    Re-slice batches of columns into batches of exactly size rows, apart from
+    the last one. Chunks with malformed records parse to short batches, and the
+    rows they are short by are made up from the batches that follow.
+    """
+    buffered: Optional[Dict[str, List]] = None
+    for columns in batches:
+        buffered = _merge_columns(buffered, columns)
+        rows = len(next(iter(buffered.values()), []))
+        if rows == size:
+            yield buffered
+            buffered = None
+        elif rows > size:
+            start = 0
+            while rows - start >= size:
+                yield {
+                    name: col[start : start + size] for name, col in buffered.items()
+                }
+                start += size
+            if start < rows:
+                buffered = {name: col[start:] for name, col in buffered.items()}
             else:
-                for sf in field.subfields:
-                    if sf.code not in subfields:
-                        continue
+                buffered = None
 
-                    key = f"F{field.tag}{sf.code}"
-                    if marc.get_subfield(field.tag, sf.code).repeatable:
-                        value: ListOrString = r.get(key, [])
-                        assert isinstance(
-                            value, list
-                        ), "Repeatable field contains a string instead of list"
-                        value.append(sf.value)
-                    else:
-                        value = sf.value
+    if buffered is not None:
+        yield buffered
 
-                    r[key] = value
 
-        rows.append(r)
+# the mapping used by a worker process, and the fields it wants decoded, which
+# are set when the process starts
+_worker_mapping: dict = {}
+_worker_wanted: Optional[Wanted] = None
 
-        # yield a batch of rows when it is ready
-        if batch > 0 and len(rows) == batch:
-            yield rows
-            rows = []
 
-    # return any remaining rows
-    if len(rows) > 0:
-        yield rows
+def _init_worker(mapping: dict) -> None:
+    global _worker_mapping, _worker_wanted
+    _worker_mapping = mapping
+    _worker_wanted = wanted_fields(mapping.keys(), mapping)
+
+
+def _parse_chunk(chunk: List[bytes]) -> Optional[Dict[str, List]]:
+    """
+    Parse a list of raw MARC21 records into a single batch of columns, or None
+    if none of the records could be parsed. This runs in a worker process.
+    """
+    records = (parse_record(raw, _worker_wanted) for raw in chunk)
+    valid = (fields for fields in records if fields is not None)
+    columns = _columns_batches(
+        valid, _worker_mapping, batch=len(chunk), allocate=len(chunk)
+    )
+    return next(columns, None)
+
+
+def _merge_columns(
+    merged: Optional[Dict[str, List]], columns: Dict[str, List]
+) -> Dict[str, List]:
+    if merged is None:
+        return columns
+    for name, col in columns.items():
+        merged[name].extend(col)
+    return merged
+
+
+def _chunked(items: Iterable[bytes], size: int) -> Generator[List[bytes], None, None]:
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _new_columns(names: Iterable[str], rows: int) -> Dict[str, List]:
+    """
+    Allocate the columns for a batch with None for the given number of rows,
+    so that they don't have to grow as the first records are added. Past that
+    they are padded as they are added to.
+    """
+    return {name: [None] * rows for name in names}
+
+
+def _add_scalar(col: list, row: int, value: Optional[str]) -> None:
+    """
+    Set the value of a non-repeatable column for the given row, which is
+    either already in the column or one past it. Columns are only padded with
+    None for the rows that lacked a value when they are next added to, so
+    records don't need to touch the columns that they don't have.
+    """
+    size = len(col)
+    if size > row:
+        col[row] = value
+    else:
+        if size < row:
+            col.extend([None] * (row - size))
+        col.append(value)
 
 
-def _stringify_field(field: pymarc.Field) -> str:
-    if field.is_control_field():
-        return field.data
+def _add_list(col: list, row: int, value: Optional[str]) -> None:
+    """
+    Add a value to the list in a repeatable column for the given row, padding
+    the column in the same way as _add_scalar.
+    """
+    size = len(col)
+    if size > row:
+        values = col[row]
+        if values is None:
+            col[row] = [value]
+        else:
+            values.append(value)
     else:
-        return " ".join([sf.value for sf in field.subfields])
+        if size < row:
+            col.extend([None] * (row - size))
+        col.append([value])
+
+
+def _resize_columns(columns: Dict[str, List], rows: int) -> Dict[str, List]:
+    """
+    Pad or truncate the columns so that they all have the given number of rows.
+    """
+    for col in columns.values():
+        size = len(col)
+        if size < rows:
+            col.extend([None] * (rows - size))
+        elif size > rows:
+            del col[rows:]
+    return columns
+
+
+def _record_batch(
+    columns: Dict[str, List], schema: pyarrow.Schema
+) -> pyarrow.RecordBatch:
+    """
+    Build each array with its type from the schema rather than inferring it,
+    and use a null array for columns that no record had a value for.
+    """
+    arrays: list = []
+    for f in schema:
+        col = columns[f.name]
+        if _is_empty(col):
+            arrays.append(pyarrow.nulls(len(col), type=f.type))
+        else:
+            arrays.append(pyarrow.array(col, type=f.type))
+    return pyarrow.RecordBatch.from_arrays(arrays, schema=schema)  # type: ignore[call-overload]
+
+
+def _csv_text(
+    data: Union[pyarrow.Table, pyarrow.RecordBatch], include_header: bool
+) -> str:
+    sink = pyarrow.BufferOutputStream()
+    options = pyarrow.csv.WriteOptions(include_header=include_header)
+    pyarrow.csv.write_csv(data, sink, options)
+    return sink.getvalue().to_pybytes().decode("utf8")
+
+
+def _stringify_lists(columns: Dict[str, List], names: List[str]) -> Dict[str, List]:
+    """
+    Replace the lists in the named columns with their string form, for output
+    formats that can't represent lists.
+    """
+    for name in names:
+        col = columns[name]
+        if not _is_empty(col):
+            columns[name] = [None if v is None else str(v) for v in col]
+    return columns
 
 
-def _mapping(rules: list) -> dict:
+def _dictionary_columns(schema: pyarrow.Schema) -> List[str]:
     """
-    unpack the mapping rules into a dictionary for easy lookup
+    List the Parquet columns to dictionary encode, which is all of them apart
+    from whole fields in UNIQUE_TAGS, unless their column is dictionary encoded
+    in Arrow already. Repeatable columns are named by the path to their values.
+    """
+    paths = []
+    for f in schema:
+        repeatable = pyarrow.types.is_list(f.type)
+        value_type = f.type.value_type if repeatable else f.type  # type: ignore[attr-defined]
+        # subfields of those fields, like the price in 020c, still repeat a lot
+        if f.name[1:] in UNIQUE_TAGS and not pyarrow.types.is_dictionary(value_type):
+            continue
+        paths.append(f"{f.name}.list.element" if repeatable else f.name)
+    return paths
+
+
+def _write_row_group(
+    writer: ParquetWriter, batches: List[pyarrow.RecordBatch], row_group_size: int
+) -> None:
+    table = pyarrow.Table.from_batches(batches, writer.schema)  # type: ignore[arg-type]
+    writer.write_table(table, row_group_size=row_group_size)
+
+
+def _is_empty(col: list) -> bool:
+    """
+    Check if a column has no values, which is common since most records only
+    have a handful of the fields in the schema.
+    """
+    return col.count(None) == len(col)
+
+
+def _jsonl(records: List[Dict]) -> bytes:
+    """
+    Serialize records as JSON Lines, using orjson when it is installed.
+    """
+    if orjson is not None:
+        option = orjson.OPT_APPEND_NEWLINE
+        return b"".join([orjson.dumps(record, option=option) for record in records])
+    else:
+        return "".join([json.dumps(record) + "\n" for record in records]).encode("utf8")
+
+
+def _stringify_field(subfields: Subfields) -> str:
+    # most fields have a single subfield, which needs no joining
+    if len(subfields) == 1:
+        return subfields[0][1]
+    return " ".join([value for _, value in subfields])
+
+
+def _mapping(rules: Iterable[str]) -> dict:
+    """
+    unpack the mapping rules into a dictionary for easy lookup, checking all
+    the rules against the schema so that every bad one is reported at once.
+    The mapping for the same rules is only made once, and is shared, so it
+    mustn't be modified.
 
     >>> _mapping(["245", "260ac"])
-    {'245': None, '260': ['a', 'c']}
+    {'245': None, '260': ('a', 'c')}
     """
+    return _rules_mapping(tuple(rules or ()))
+
+
+@cache
+def _rules_mapping(rules: Tuple[str, ...]) -> dict:
     marc = MARC.from_avram()
-    if rules is None or len(rules) == 0:
-        rules = [field.tag for field in marc.fields]
+    if len(rules) == 0:
+        rules = tuple(marc.fields.keys())
 
     m = {}
+    errors = []
     for rule in rules:
         field_tag = rule[0:3]
-        if marc.get_field(field_tag) is None:
-            raise Exception(f"unknown MARC field in mapping rule: {rule}")
+        field = marc.fields.get(field_tag)
+        if field is None:
+            errors.append(f"unknown MARC field in mapping rule: {rule}")
+            continue
 
-        subfields = set(list(rule[3:]))
-        for subfield_code in subfields:
-            if marc.get_subfield(field_tag, subfield_code) is None:
-                raise Exception(f"unknown MARC subfield in mapping rule: {rule}")
+        # subfields keep the order of the rule, which is the order of the columns
+        subfields = tuple(dict.fromkeys(rule[3:]))
+        unknown = [code for code in subfields if code not in field.subfields]
+        if unknown:
+            codes = ", ".join(sorted(unknown))
+            errors.append(f"unknown MARC subfield {codes} in mapping rule: {rule}")
+            continue
 
         m[field_tag] = subfields or None
 
+    if errors:
+        raise ValueError("\n".join(errors))
+
     return m
 
 
+def _plan(mapping: dict) -> Dict[str, Union[Target, Dict[str, Target]]]:
+    """
+    Resolve the mapping into the column that each field, or each subfield
+    code, is added to and whether it is repeatable. This is done once so that
+    the record loop doesn't need to consult the schema or build column names.
+
+    >>> _plan({"245": None, "260": {"c"}})
+    {'245': ('F245', False), '260': {'c': ('F260c', True)}}
+    """
+    marc = MARC.from_avram()
+    plan: Dict[str, Union[Target, Dict[str, Target]]] = {}
+    for tag, subfields in mapping.items():
+        if subfields is None:
+            plan[tag] = (f"F{tag}", marc.get_field(tag).repeatable)
+        else:
+            plan[tag] = {
+                code: (f"F{tag}{code}", marc.get_subfield(tag, code).repeatable)
+                for code in subfields
+            }
+    return plan
+
+
+def _bind_plan(
+    plan: Dict[str, Union[Target, Dict[str, Target]]], columns: Dict[str, List]
+) -> Dict[str, Union[BoundFieldTarget, Dict[str, BoundTarget]]]:
+    """
+    Swap the column names in a plan for the column lists of a batch, so that
+    values can be added without looking their column up. The function used to
+    add values depends on whether the column is repeatable, and whole fields
+    also get the function that stringifies them. Both are picked once per tag
+    rather than checked for every value.
+    """
+    bound: Dict[str, Union[BoundFieldTarget, Dict[str, BoundTarget]]] = {}
+    for tag, target in plan.items():
+        if isinstance(target, tuple):
+            name, repeatable = target
+            # control fields are already strings
+            stringify: Callable[[Any], str] = _stringify_field
+            if tag.encode("ascii") in CONTROL_TAGS:
+                stringify = str
+            bound[tag] = (columns[name], _adder(repeatable), stringify)
+        else:
+            bound[tag] = {
+                code: (columns[name], _adder(repeatable))
+                for code, (name, repeatable) in target.items()
+            }
+    return bound
+
+
+def _adder(repeatable: bool) -> Adder:
+    return _add_list if repeatable else _add_scalar
+
+
 def _columns(mapping: dict) -> list:
     """
     unpack the mapping to get a list of columns for the table
@@ -196,42 +709,37 @@ def _columns(mapping: dict) -> list:
     return cols
 
 
-def _make_pandas_schema(rules: list) -> Dict[str, str]:
+def _make_parquet_schema(mapping: dict, dict_encode: list = []) -> pyarrow.Schema:
     marc = MARC.from_avram()
-    mapping = _mapping(rules)
-    schema = {}
-    for field_tag, subfields in mapping.items():
-        if subfields is None:
-            schema[f"F{field_tag}"] = (
-                "object" if marc.get_field(field_tag).repeatable else "str"
-            )
-        else:
-            for sf in subfields:
-                schema[f"F{field_tag}{sf}"] = (
-                    "object" if marc.get_subfield(field_tag, sf).repeatable else "str"
-                )
-    return schema
 
-
-def _make_parquet_schema(rules: list) -> pyarrow.Schema:
-    marc = MARC.from_avram()
-    mapping = _mapping(rules)
-
-    pyarrow_str = pyarrow.string()
-    pyarrow_list_of_str = pyarrow.list_(pyarrow.string())
+    columns = set(_columns(mapping))
+    unknown = [name for name in dict_encode if f"F{name}" not in columns]
+    if unknown:
+        raise ValueError(
+            "\n".join(
+                f"unknown column to dictionary encode: {name}" for name in unknown
+            )
+        )
+    dict_cols = {f"F{name}" for name in dict_encode}
 
     cols: List[Tuple[str, pyarrow.DataType]] = []
     for field_tag, subfields in mapping.items():
         if subfields is None:
-            if marc.get_field(field_tag).repeatable:
-                cols.append((f"F{field_tag}", pyarrow_list_of_str))
-            else:
-                cols.append((f"F{field_tag}", pyarrow_str))
+            name = f"F{field_tag}"
+            repeatable = marc.get_field(field_tag).repeatable
+            cols.append((name, _column_type(name, repeatable, dict_cols)))
         else:
             for sf_code in subfields:
-                sf = marc.get_subfield(field_tag, sf_code)
-                if sf is not None and sf.repeatable:
-                    cols.append((f"F{field_tag}{sf}", pyarrow_list_of_str))
-                else:
-                    cols.append((f"F{field_tag}{sf}", pyarrow_str))
+                name = f"F{field_tag}{sf_code}"
+                repeatable = marc.get_subfield(field_tag, sf_code).repeatable
+                cols.append((name, _column_type(name, repeatable, dict_cols)))
     return pyarrow.schema(cols)  # type: ignore[arg-type]
+
+
+def _column_type(name: str, repeatable: bool, dict_cols: set) -> pyarrow.DataType:
+    value_type = (
+        pyarrow.dictionary(pyarrow.int32(), pyarrow.string())
+        if name in dict_cols
+        else pyarrow.string()
+    )
+    return pyarrow.list_(value_type) if repeatable else value_type
@@ -1,13 +1,63 @@
 import json
+import os
 import pathlib
-from io import StringIO
+from io import BufferedReader, BytesIO, StringIO
+from itertools import islice
 
+import marctable.utils
 import pandas
-from marctable.marc import MARC, SchemaFieldError, SchemaSubfieldError, crawl
-from marctable.utils import _mapping, dataframe_iter, to_csv, to_dataframe, to_parquet
-from pytest import raises
-
-marc = MARC.from_avram()
+import pyarrow
+import pyarrow.csv
+import pyarrow.parquet
+import pymarc
+from marctable.marc import MARC, Field, SchemaFieldError, SchemaSubfieldError, crawl
+from marctable.reader import (
+    Fields,
+    parse_record,
+    read_records,
+    read_xml_records,
+    split_records,
+    wanted_fields,
+)
+from marctable.utils import (
+    _columns,
+    _jsonl,
+    _mapping,
+    _plan,
+    dataframe_iter,
+    record_batch_iter,
+    records_iter,
+    to_csv,
+    to_dataframe,
+    to_jsonl,
+    to_parquet,
+    to_table,
+)
+from pytest import MonkeyPatch, fixture, raises
+
+
+@fixture(scope="session")
+def marc() -> MARC:
+    """
+    The schema that ships with marctable, which conversions share.
+    """
+    return MARC.from_avram()
+
+
+@fixture(scope="session")
+def marc_bytes() -> bytes:
+    """
+    The bytes of test-data/utf8.marc, read once for the tests that convert it.
+    """
+    return pathlib.Path("test-data/utf8.marc").read_bytes()
+
+
+@fixture(scope="session")
+def full_df(marc_bytes: bytes) -> pandas.DataFrame:
+    """
+    A DataFrame of every field in test-data/utf8.marc, built once.
+    """
+    return to_dataframe(BytesIO(marc_bytes))
 
 
 def test_crawl() -> None:
@@ -36,38 +86,46 @@ def test_crawl() -> None:
     assert f0152["repeatable"] is False
 
 
-def test_marc() -> None:
+def test_marc(marc: MARC) -> None:
     assert len(marc.fields) == 215
 
 
-def test_get_field() -> None:
+def test_from_avram(marc: MARC) -> None:
+    # the default schema is only loaded once
+    assert MARC.from_avram() is marc
+
+    # as is a schema file with the same contents
+    assert MARC.from_avram(marc.avram_file.open("r")) is marc
+
+
+def test_get_field(marc: MARC) -> None:
     assert marc.get_field("245")
     with raises(SchemaFieldError, match="abc is not a defined field tag in Avram"):
         marc.get_field("abc")
 
 
-def test_get_subfield() -> None:
+def test_get_subfield(marc: MARC) -> None:
     assert marc.get_subfield("245", "a").label == "Title"
     with raises(SchemaSubfieldError, match="- is not a valid subfield in field 245"):
         marc.get_subfield("245", "-") is None
 
 
-def test_non_repeatable_field() -> None:
+def test_non_repeatable_field(marc: MARC) -> None:
     f245 = marc.get_field("245")
     assert f245.tag == "245"
     assert f245.label == "Title Statement"
     assert f245.repeatable is False
 
 
-def test_repeatable_field() -> None:
+def test_repeatable_field(marc: MARC) -> None:
     f650 = marc.get_field("650")
     assert f650.tag == "650"
     assert f650.label == "Subject Added Entry-Topical Term"
     assert f650.repeatable is True
 
 
-def test_df() -> None:
-    df = to_dataframe(open("test-data/utf8.marc", "rb"))
+def test_df(full_df: pandas.DataFrame) -> None:
+    df = full_df
     assert len(df.columns) == 215
     assert len(df) == 10612
     assert df.iloc[0]["F008"] == "000110s2000    ohu    f   m        eng  "
@@ -79,10 +137,14 @@ def test_df() -> None:
     )
     # 650 is repeatable
     assert df.iloc[0]["F650"] == ["Leak detectors.", "Gas leakage."]
+    # columns are built directly from the lists, leaving missing values as None
+    assert (df.dtypes == "object").all()
+    assert df.iloc[0]["F880"] is None
+    assert df["F650"].isna().sum() == 885
 
 
-def test_custom_fields_df() -> None:
-    df = to_dataframe(open("test-data/utf8.marc", "rb"), rules=["245", "650"])
+def test_custom_fields_df(marc_bytes: bytes) -> None:
+    df = to_dataframe(BytesIO(marc_bytes), rules=["245", "650"])
     assert len(df) == 10612
     # should only have two columns in the dataframe
     assert len(df.columns) == 2
@@ -96,8 +158,8 @@ def test_custom_fields_df() -> None:
     assert df.iloc[0]["F650"] == ["Leak detectors.", "Gas leakage."]
 
 
-def test_custom_subfields_df() -> None:
-    df = to_dataframe(open("test-data/utf8.marc", "rb"), rules=["245a", "260c"])
+def test_custom_subfields_df(marc_bytes: bytes) -> None:
+    df = to_dataframe(BytesIO(marc_bytes), rules=["245a", "260c"])
     assert len(df) == 10612
     assert len(df.columns) == 2
     assert df.columns[0] == "F245a"
@@ -108,63 +170,252 @@ def test_custom_subfields_df() -> None:
     assert df.iloc[0]["F260c"] == ["c2000."]
 
 
+def test_arrow_df(marc_bytes: bytes) -> None:
+    df = to_dataframe(BytesIO(marc_bytes), rules=["245a", "260c", "880"], arrow=True)
+    assert len(df) == 10612
+    assert list(df.columns) == ["F245a", "F260c", "F880"]
+    assert df.dtypes["F245a"] == pandas.ArrowDtype(pyarrow.string())
+    assert df.dtypes["F260c"] == pandas.ArrowDtype(pyarrow.list_(pyarrow.string()))
+    assert df.iloc[0]["F245a"] == "Leak testing CD-ROM"
+    assert df.iloc[0]["F260c"] == ["c2000."]
+    assert df.iloc[0]["F880"] is pandas.NA
+
+
 def test_field_mapping() -> None:
     m = _mapping(["245", "650"])
     assert m["245"] is None
     assert m["650"] is None
 
+    # the mapping is only made once for the same rules, however they're passed
+    assert _mapping(("245", "650")) is m
+    assert _mapping([]) is _mapping(())
+
 
 def test_field_subfield_mapping() -> None:
-    m = _mapping(["245a", "650ax", "260"])
-    assert set(m["245"]) == set(["a"])
-    assert set(m["650"]) == set(["a", "x"])
+    m = _mapping(["245a", "650axvz", "260"])
+    assert m["245"] == ("a",)
+    assert m["650"] == ("a", "x", "v", "z")
     assert m["260"] is None
+    assert _columns(m) == ["F245a", "F650a", "F650x", "F650v", "F650z", "F260"]
+
+
+def test_bad_mapping() -> None:
+    # all the bad rules are reported together
+    with raises(ValueError) as e:
+        _mapping(["245a", "abc", "650-"])
+    assert str(e.value) == (
+        "unknown MARC field in mapping rule: abc\n"
+        "unknown MARC subfield - in mapping rule: 650-"
+    )
+
+
+def test_plan() -> None:
+    plan = _plan(_mapping(["245", "260c"]))
+    assert plan["245"] == ("F245", False)
+    assert plan["260"] == {"c": ("F260c", True)}
+
 
+def test_plan_schema_lookups(marc_bytes: bytes, monkeypatch: MonkeyPatch) -> None:
+    # the schema is consulted once per column, not for every record
+    tags = []
+    get_field = MARC.get_field
 
-def test_batch() -> None:
-    dfs = dataframe_iter(open("test-data/utf8.marc", "rb"), batch=1000)
+    def counting_get_field(marc: MARC, tag: str) -> Field:
+        tags.append(tag)
+        return get_field(marc, tag)
+
+    monkeypatch.setattr(MARC, "get_field", counting_get_field)
+    df = to_dataframe(BytesIO(marc_bytes), ["245", "650a"])
+    assert len(df) == 10612
+    assert tags == ["245", "650"]
+
+
+def test_batch(marc_bytes: bytes) -> None:
+    dfs = dataframe_iter(BytesIO(marc_bytes), batch=1000)
     df = next(dfs)
     assert type(df), pandas.DataFrame
     assert len(df) == 1000
 
+    # files opened from a file descriptor are named by it rather than a path
+    with open(os.open("test-data/utf8.marc", os.O_RDONLY), "rb") as marc_input:
+        df = next(dataframe_iter(marc_input, batch=1000))
+    assert len(df) == 1000
+
+
+def test_to_table() -> None:
+    table = to_table(open("test-data/utf8.marc", "rb"), rules=["245a", "650"])
+    assert table.num_rows == 10612
+    assert table.column_names == ["F245a", "F650"]
+    assert table.column("F650").type == pyarrow.list_(pyarrow.string())
+    assert table.column("F245a").num_chunks == 11
+    assert table.column("F245a")[0].as_py() == "Leak testing CD-ROM"
+
 
-def test_to_csv() -> None:
-    to_csv(
-        open("test-data/utf8.marc", "rb"), open("test-data/utf8.csv", "w"), batch=1000
+def test_to_csv(
+    marc_bytes: bytes, full_df: pandas.DataFrame, tmp_path: pathlib.Path
+) -> None:
+    csv_path = tmp_path / "utf8.csv"
+    to_csv(BytesIO(marc_bytes), open(csv_path, "w"), batch=1000)
+
+    # Arrow's CSV reader is quick enough to check every value, when it is told
+    # that the columns are strings rather than left to infer their types
+    options = pyarrow.csv.ConvertOptions(
+        column_types={name: pyarrow.string() for name in full_df},
+        strings_can_be_null=True,
     )
-    df = pandas.read_csv("test-data/utf8.csv")
-    assert len(df) == 10612
-    assert len(df.columns) == 215
+    table = pyarrow.csv.read_csv(csv_path, convert_options=options)
+    assert table.column_names == list(full_df)
+    assert table.num_rows == len(full_df)
     assert (
-        df.iloc[0]["F245"]
+        table.column("F245")[0].as_py()
         == "Leak testing CD-ROM [computer file] / technical editors, Charles N. "
         "Jackson, Jr., Charles N. Sherlock ; editor, Patrick O. Moore."
     )
+    # repeatable columns are written as the string form of their lists, and
+    # the columns are compared as Arrow arrays, which is much quicker than
+    # comparing them as lists of Python strings
+    expected = full_df.map(lambda v: v if v is None or isinstance(v, str) else str(v))
+    for name in full_df:
+        values = pyarrow.array(expected[name].to_numpy(), pyarrow.string())
+        assert table.column(name).combine_chunks().equals(values)
+
+    # binary output, like the command line uses, should be the same
+    csv_output = BytesIO()
+    to_csv(BytesIO(marc_bytes), csv_output, batch=1000)
+    assert csv_output.getvalue() == open(csv_path, "rb").read()
+
+    # including when there are no records, and only the header is written
+    csv_output = BytesIO()
+    text_output = StringIO()
+    to_csv(BytesIO(), csv_output, rules=["245", "650a"])
+    to_csv(BytesIO(), text_output, rules=["245", "650a"])
+    assert csv_output.getvalue() == b'"F245","F650a"\n'
+    assert text_output.getvalue() == '"F245","F650a"\n'
+
+
+def test_to_parquet(
+    marc_bytes: bytes, full_df: pandas.DataFrame, tmp_path: pathlib.Path
+) -> None:
+    parquet_path = tmp_path / "utf8.parquet"
+    to_parquet(
+        BytesIO(marc_bytes),
+        open(parquet_path, "wb"),
+        batch=1000,
+    )
+    # the footer is enough to check the shape, without reading the data
+    metadata = pyarrow.parquet.read_metadata(parquet_path)
+    assert metadata.num_rows == len(full_df)
+    assert metadata.num_columns == len(full_df.columns)
+    assert metadata.schema.to_arrow_schema().names == list(full_df)
 
 
-def test_to_parquet() -> None:
+def test_to_parquet_with_rules(marc_bytes: bytes, tmp_path: pathlib.Path) -> None:
+    parquet_path = tmp_path / "utf8.parquet"
     to_parquet(
-        open("test-data/utf8.marc", "rb"),
-        open("test-data/utf8.parquet", "wb"),
+        BytesIO(marc_bytes),
+        open(parquet_path, "wb"),
         batch=1000,
+        rules=["001", "245", "650v", "020c"],
     )
-    assert pathlib.Path("test-data/utf8.parquet").is_file()
-    df = pandas.read_parquet("test-data/utf8.parquet")
-    assert len(df) == 10612
-    assert len(df.columns) == 215
+    # the shape comes from the footer, without decoding any of the data
+    metadata = pyarrow.parquet.read_metadata(parquet_path)
+    assert metadata.num_rows == 10612
+    assert metadata.num_columns == 4
+
+    # the batches are written as one row group
+    assert metadata.num_row_groups == 1
 
+    # string values are dictionary encoded and compressed in the parquet file
+    column = metadata.row_group(0).column(1)
+    assert "RLE_DICTIONARY" in column.encodings
+    assert column.compression == "ZSTD"
 
-def test_to_parquet_with_rules() -> None:
+    # except for fields with a different value in nearly every record
+    column = metadata.row_group(0).column(0)
+    assert column.path_in_schema == "F001"
+    assert "RLE_DICTIONARY" not in column.encodings
+
+    # but not their subfields, which can repeat as much as any other column
+    column = metadata.row_group(0).column(3)
+    assert column.path_in_schema == "F020c"
+    assert "RLE_DICTIONARY" in column.encodings
+
+
+def test_to_parquet_dict_encode(tmp_path: pathlib.Path) -> None:
+    parquet_path = tmp_path / "utf8.parquet"
     to_parquet(
         open("test-data/utf8.marc", "rb"),
-        open("test-data/utf8.parquet", "wb"),
-        batch=1000,
-        rules=["001", "245", "650v"],
+        open(parquet_path, "wb"),
+        rules=["008", "040b", "650"],
+        dict_encode=["040b", "650"],
+        row_group_size=5000,
     )
-    assert pathlib.Path("test-data/utf8.parquet").is_file()
-    df = pandas.read_parquet("test-data/utf8.parquet")
+    # the schema and row groups come from the footer
+    metadata = pyarrow.parquet.read_metadata(parquet_path)
+    schema = metadata.schema.to_arrow_schema()
+    dict_str = pyarrow.dictionary(pyarrow.int32(), pyarrow.string())
+    assert schema.types == [
+        pyarrow.string(),
+        dict_str,
+        pyarrow.list_(dict_str),
+    ]
+
+    assert metadata.num_row_groups == 3
+
+    df = pandas.read_parquet(parquet_path)
     assert len(df) == 10612
-    assert len(df.columns) == 3
+    assert list(df.iloc[0]["F650"]) == ["Leak detectors.", "Gas leakage."]
+
+    # columns that aren't in the rules are reported as they were given
+    with raises(ValueError) as e:
+        to_parquet(
+            open("test-data/utf8.marc", "rb"),
+            open(parquet_path, "wb"),
+            rules=["040b", "650"],
+            dict_encode=["040x", "650", "700e"],
+        )
+    assert str(e.value) == (
+        "unknown column to dictionary encode: 040x\n"
+        "unknown column to dictionary encode: 700e"
+    )
+
+
+def test_record_batch_iter() -> None:
+    # only the last batch has F880 values, but every batch has the same schema
+    batches = list(
+        record_batch_iter(open("test-data/utf8.marc", "rb"), rules=["245a", "880"])
+    )
+    assert len(batches) == 11
+    assert all(b.schema == batches[0].schema for b in batches)
+    assert batches[0].schema.types == [
+        pyarrow.string(),
+        pyarrow.list_(pyarrow.string()),
+    ]
+
+
+def test_to_jsonl(tmp_path: pathlib.Path) -> None:
+    jsonl_path = tmp_path / "utf8.jsonl"
+    to_jsonl(
+        open("test-data/utf8.marc", "rb"),
+        open(jsonl_path, "wb"),
+        rules=["245", "650a"],
+    )
+    records = [json.loads(line) for line in open(jsonl_path)]
+    assert len(records) == 10612
+    # fields that a record doesn't have are left out
+    assert records[0] == {
+        "F245": "Leak testing CD-ROM [computer file] / technical editors, "
+        "Charles N. Jackson, Jr., Charles N. Sherlock ; editor, Patrick O. Moore.",
+        "F650a": "Gas leakage.",
+    }
+
+
+def test_jsonl_without_orjson(monkeypatch: MonkeyPatch) -> None:
+    # the json module is used when orjson isn't installed
+    records = next(records_iter(open("test-data/utf8.marc", "rb"), ["008", "650"]))
+    monkeypatch.setattr(marctable.utils, "orjson", None)
+    lines = _jsonl(records).decode("utf8").splitlines()
+    assert [json.loads(line) for line in lines] == records
 
 
 def test_xml() -> None:
@@ -181,3 +432,163 @@ def test_xml() -> None:
     )
     # 650 is repeatable
     assert df.iloc[0]["F650"] == ["Leak detectors.", "Gas leakage."]
+
+
+def test_read_records() -> None:
+    # the lightweight reader should see the same fields that pymarc does
+    records = read_records(open("test-data/marc8.marc", "rb"))
+    pymarc_records = pymarc.MARCReader(open("test-data/marc8.marc", "rb"))
+    for fields, record in islice(zip(records, pymarc_records), 1000):
+        assert fields == record_fields(record)
+
+    # or only the fields that were asked for
+    fields = next(read_records(open("test-data/utf8.marc", "rb"), ["008", "650"]))
+    assert fields == [
+        ("008", "000110s2000    ohu    f   m        eng  "),
+        ("650", [("a", "Leak detectors.")]),
+        ("650", [("a", "Gas leakage.")]),
+    ]
+
+    # or only the subfields that were asked for
+    fields = next(
+        read_records(open("test-data/utf8.marc", "rb"), ["245"], {"245": ["a"]})
+    )
+    assert fields == [("245", [("a", "Leak testing CD-ROM")])]
+
+    # which are the same fields that pymarc has for those tags
+    record = next(pymarc.MARCReader(open("test-data/utf8.marc", "rb")))
+    assert [f for f in record_fields(record) if f[0] in ("008", "650")] == next(
+        read_records(open("test-data/utf8.marc", "rb"), ["008", "650"])
+    )
+
+
+def test_parse_record(marc_bytes: bytes) -> None:
+    raw = next(split_records(BytesIO(marc_bytes)))
+    record = pymarc.Record(raw)
+    assert parse_record(raw) == record_fields(record)
+
+    # malformed records are skipped rather than raising an error
+    assert parse_record(raw[:12] + b"xxxxx" + raw[17:]) is None  # base address
+    assert parse_record(raw[:30] + raw[31:]) is None  # directory entry length
+    assert parse_record(raw[:24] + b"245xxxx00000" + raw[36:]) is None  # field length
+    assert parse_record(raw[:24]) is None  # truncated record
+
+
+def test_read_xml_records() -> None:
+    # MARCXML is read incrementally, but should match what pymarc sees
+    records = list(read_xml_records(open("test-data/marc.xml", "rb")))
+    pymarc_records = pymarc.marcxml.parse_xml_to_array(open("test-data/marc.xml", "rb"))
+    assert len(records) == len(pymarc_records) == 10631
+    for fields, record in zip(records, pymarc_records):
+        assert fields == record_fields(record)
+
+    # and can be limited to fields and subfields in the same way
+    fields = next(
+        read_xml_records(
+            open("test-data/marc.xml", "rb"), ["245", "650"], {"245": ["a"]}
+        )
+    )
+    assert fields == [
+        ("245", [("a", "Leak testing CD-ROM")]),
+        ("650", [("a", "Leak detectors.")]),
+        ("650", [("a", "Gas leakage.")]),
+    ]
+
+
+def test_wanted_fields(marc_bytes: bytes) -> None:
+    # rules are resolved once into byte tags and integer subfield codes, which
+    # are what parse_record compares the directory and subfields against
+    wanted = wanted_fields(["245", "650"], {"245": ["a", "c"]})
+    assert wanted == {b"245": frozenset([0x61, 0x63]), b"650": None}
+
+    raw = next(split_records(BytesIO(marc_bytes)))
+    assert parse_record(raw, wanted) == [
+        (
+            "245",
+            [
+                ("a", "Leak testing CD-ROM"),
+                (
+                    "c",
+                    "technical editors, Charles N. Jackson, Jr., Charles N. "
+                    "Sherlock ; editor, Patrick O. Moore.",
+                ),
+            ],
+        ),
+        ("650", [("a", "Leak detectors.")]),
+        ("650", [("a", "Gas leakage.")]),
+    ]
+
+    # and no lookup at all means every field
+    assert wanted_fields() is None
+
+
+def test_split_records(marc_bytes: bytes) -> None:
+    # files are memory mapped, but streams should be split the same way
+    records = list(split_records(open("test-data/utf8.marc", "rb")))
+    assert len(records) == 10612
+    stream = BufferedReader(BytesIO(marc_bytes))  # type: ignore[arg-type]
+    assert records == list(split_records(stream))
+
+    # BytesIO is split in place, starting from its current position
+    assert records == list(split_records(BytesIO(marc_bytes)))
+    marc_input = BytesIO(marc_bytes)
+    marc_input.seek(len(records[0]))
+    assert records[1:] == list(split_records(marc_input))
+
+
+def test_workers() -> None:
+    # parsing with a pool of processes should give the same results
+    rules = ["001", "245a", "650"]
+    df = to_dataframe(open("test-data/utf8.marc", "rb"), rules=rules)
+    df_workers = to_dataframe(open("test-data/utf8.marc", "rb"), rules=rules, workers=2)
+    assert df.equals(df_workers)
+
+    # batches are parsed in parallel too, but yielded in the order they were read
+    dfs = dataframe_iter(open("test-data/utf8.marc", "rb"), rules, 3000)
+    dfs_workers = dataframe_iter(open("test-data/utf8.marc", "rb"), rules, 3000, 2)
+    sizes = []
+    for batch_df, batch_df_workers in zip(dfs, dfs_workers, strict=True):
+        assert batch_df.equals(batch_df_workers)
+        sizes.append(len(batch_df))
+    assert sizes == [3000, 3000, 3000, 1612]
+
+    # chunks where every record is malformed are skipped, just like the records
+    raws = list(split_records(open("test-data/utf8.marc", "rb")))
+    bad = [raw[:12] + b"xxxxx" + raw[17:] for raw in raws[:1000]]
+    marc_bytes = b"".join(bad + raws[1000:1100])
+    df = to_dataframe(BytesIO(marc_bytes), rules=rules)
+    df_workers = to_dataframe(BytesIO(marc_bytes), rules=rules, workers=2)
+    assert len(df) == 100
+    assert df.equals(df_workers)
+
+    # batches are the same size as they would be without workers, even when
+    # malformed records leave the chunks the workers parse short
+    marc_bytes = b"".join(bad[:3] + raws[:20])
+    dfs = dataframe_iter(BytesIO(marc_bytes), rules, 5)
+    dfs_workers = dataframe_iter(BytesIO(marc_bytes), rules, 5, 2)
+    sizes = []
+    for batch_df, batch_df_workers in zip(dfs, dfs_workers, strict=True):
+        assert list(batch_df.columns) == ["F001", "F245a", "F650"]
+        assert batch_df.equals(batch_df_workers)
+        sizes.append(len(batch_df_workers))
+    assert sizes == [5, 5, 5, 5]
+
+    # and every batch has the subfield columns in the order of the rule
+    rules = ["650axvz"]
+    dfs_workers = dataframe_iter(open("test-data/utf8.marc", "rb"), rules, 1000, 2)
+    for batch_df in dfs_workers:
+        assert list(batch_df.columns) == ["F650a", "F650x", "F650v", "F650z"]
+
+
+def record_fields(record: pymarc.Record) -> Fields:
+    """
+    Convert a pymarc Record into the same list of fields that parse_record
+    returns, to compare them.
+    """
+    fields: Fields = []
+    for field in record.fields:
+        if field.is_control_field():
+            fields.append((field.tag, field.data or ""))
+        else:
+            fields.append((field.tag, [(sf.code, sf.value) for sf in field.subfields]))
+    return fields